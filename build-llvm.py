@@ -1,58 +1,74 @@
 #!/usr/bin/env python3
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name,wrong-import-position
 
-from argparse import ArgumentParser, RawTextHelpFormatter
+from argparse import ArgumentParser, ArgumentTypeError, RawTextHelpFormatter
 from pathlib import Path
 import platform
+import shutil
+import sys
 import textwrap
+import threading
 import time
 
 import tc_build.utils
 
-from tc_build.llvm import LLVMBootstrapBuilder, LLVMBuilder, LLVMInstrumentedBuilder, LLVMSlimBuilder, LLVMSlimInstrumentedBuilder, LLVMSourceManager
-from tc_build.kernel import KernelBuilder, LinuxSourceManager, LLVMKernelBuilder
-from tc_build.tools import HostTools, StageTools
-
 # This is a known good revision of LLVM for building the kernel
 GOOD_REVISION = '5ce271ef74dd3325993c827f496e460ced41af11'
 
 # The version of the Linux kernel that the script downloads if necessary
 DEFAULT_KERNEL_FOR_PGO = (6, 13, 0)
 
-parser = ArgumentParser(formatter_class=RawTextHelpFormatter)
+
+# The help text below is indented to match the code around it. Only dedent it
+# when help is actually being shown, rather than on every invocation.
+class RawDedentHelpFormatter(RawTextHelpFormatter):
+
+    def _split_lines(self, text, width):
+        return super()._split_lines(textwrap.dedent(text), width)
+
+
+# Catch malformed defines while parsing, rather than after the source has been
+# downloaded and the host tools have been checked.
+def cmake_define(value):
+    if '=' not in value:
+        raise ArgumentTypeError(f"'{value}' is not in the form KEY=VALUE")
+    return value
+
+
+parser = ArgumentParser(formatter_class=RawDedentHelpFormatter)
 clone_options = parser.add_mutually_exclusive_group()
 opt_options = parser.add_mutually_exclusive_group()
 
 parser.add_argument('--assertions',
-                    help=textwrap.dedent('''\
+                    help='''\
                     In a release configuration, assertions are not enabled. Assertions can help catch
                     issues when compiling but it will increase compile times by 15-20%%.
 
-                    '''),
+                    ''',
                     action='store_true')
 parser.add_argument('-b',
                     '--build-folder',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script will create a "build/llvm" folder in the same folder as this
                     script and build each requested stage within that containing folder. To change the
                     location of the containing build folder, pass it to this parameter. This can be either
                     an absolute or relative path.
 
-                    '''),
+                    ''',
                     type=str)
 parser.add_argument('--build-targets',
                     default=['all'],
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the 'all' target is used as the build target for the final stage. With
                     this option, targets such as 'distribution' could be used to generate a slimmer
                     toolchain or targets such as 'clang' or 'llvm-ar' could be used to just test building
                     individual tools for a bisect.
 
                     NOTE: This only applies to the final stage build to avoid complicating tc-build internals.
-                    '''),
+                    ''',
                     nargs='+')
 parser.add_argument('--bolt',
-                    help=textwrap.dedent('''\
+                    help='''\
                     Optimize the final clang binary with BOLT (Binary Optimization and Layout Tool), which can
                     often improve compile time performance by 5-7%% on average.
 
@@ -98,10 +114,10 @@ parser.add_argument('--bolt',
                                 your machine supports it, upgrade the amount of memory you have (if possible),
                                 or run build-llvm.py without '--bolt'.
 
-                    '''),
+                    ''',
                     action='store_true')
 opt_options.add_argument('--build-stage1-only',
-                         help=textwrap.dedent('''\
+                         help='''\
                     By default, the script does a multi-stage build: it builds a more lightweight version of
                     LLVM first (stage 1) then uses that build to build the full toolchain (stage 2). This
                     is also known as bootstrapping.
@@ -110,24 +126,28 @@ opt_options.add_argument('--build-stage1-only',
                     this option is more intended for quick testing and verification of issues and not regular
                     use. However, if your system is slow or can't handle 2+ stage builds, you may need this flag.
 
-                         '''),
+                         ''',
                          action='store_true')
 # yapf: disable
 parser.add_argument('--build-type',
                     metavar='BUILD_TYPE',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script does a Release build; Debug may be useful for tracking down
                     particularly nasty bugs.
 
+                    For Debug and RelWithDebInfo, LLVM_USE_SPLIT_DWARF is enabled to speed up linking, so the
+                    debug information is stored in .dwo files within the build folder. Pass
+                    '-D LLVM_USE_SPLIT_DWARF=OFF' to keep it within the binaries.
+
                     See https://llvm.org/docs/GettingStarted.html#compiling-the-llvm-suite-source-code for
                     more information.
 
-                    '''),
+                    ''',
                     type=str,
                     choices=['Release', 'Debug', 'RelWithDebInfo', 'MinSizeRel'])
 # yapf: enable
 parser.add_argument('--check-targets',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, no testing is run on the toolchain. If you would like to run unit/regression
                     tests, use this parameter to specify a list of check targets to run with ninja. Common
                     ones include check-llvm, check-clang, and check-lld.
@@ -136,11 +156,11 @@ parser.add_argument('--check-targets',
 
                     Example: '--check-targets clang llvm' will make ninja invokve 'check-clang' and 'check-llvm'.
 
-                    '''),
+                    ''',
                     nargs='+')
 parser.add_argument('-D',
                     '--defines',
-                    help=textwrap.dedent('''\
+                    help='''\
                     Specify additional cmake values. These will be applied to all cmake invocations.
 
                     Example: -D LLVM_PARALLEL_COMPILE_JOBS=2 LLVM_PARALLEL_LINK_JOBS=2
@@ -148,11 +168,12 @@ parser.add_argument('-D',
                     See https://llvm.org/docs/CMake.html for various cmake values. Note that some of
                     the options to this script correspond to cmake values.
 
-                    '''),
-                    nargs='+')
+                    ''',
+                    nargs='+',
+                    type=cmake_define)
 parser.add_argument('-f',
                     '--full-toolchain',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script tunes LLVM for building the Linux kernel by disabling several
                     projects, targets, and configuration options, which speeds up build times but limits
                     how the toolchain could be used.
@@ -163,19 +184,19 @@ parser.add_argument('-f',
                     useful when using the script to do upstream LLVM development or trying to use LLVM as a
                     system-wide toolchain.
 
-                    '''),
+                    ''',
                     action='store_true')
 parser.add_argument('-i',
                     '--install-folder',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script will leave the toolchain in its build folder. To install it
                     outside the build folder for persistent use, pass the installation location that you
                     desire to this parameter. This can be either an absolute or relative path.
 
-                    '''),
+                    ''',
                     type=str)
 parser.add_argument('--install-targets',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script will just run the 'install' target to install the toolchain to
                     the desired prefix. To produce a slimmer toolchain, specify the desired targets to
                     install using this options.
@@ -185,31 +206,31 @@ parser.add_argument('--install-targets',
                     Example: '--install-targets clang lld' will make ninja invoke 'install-clang' and
                              'install-lld'.
 
-                    '''),
+                    ''',
                     nargs='+')
 parser.add_argument('-l',
                     '--llvm-folder',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script will clone the llvm-project into the tc-build repo. If you have
                     another LLVM checkout that you would like to work out of, pass it to this parameter.
                     This can either be an absolute or relative path. Implies '--no-update'. When this
                     option is supplied, '--ref' and '--use-good-revison' do nothing, as the script does
                     not manipulate a repository it does not own.
 
-                    '''),
+                    ''',
                     type=str)
 parser.add_argument('-L',
                     '--linux-folder',
-                    help=textwrap.dedent('''\
+                    help='''\
                     If building with PGO, use this kernel source for building profiles instead of downloading
                     a tarball from kernel.org. This should be the full or relative path to a complete kernel
                     source directory, not a tarball or zip file.
 
-                    '''),
+                    ''',
                     type=str)
 parser.add_argument('--lto',
                     metavar='LTO_TYPE',
-                    help=textwrap.dedent('''\
+                    help='''\
                     Build the final compiler with either ThinLTO (thin) or full LTO (full), which can
                     often improve compile time performance by 3-5%% on average.
 
@@ -222,23 +243,31 @@ parser.add_argument('--lto',
                     This option should not be used with '--build-stage1-only' unless you know that your
                     host compiler and linker support it. See the two links below for more information.
 
+                    When ThinLTO is used with ld.lld, a ThinLTO cache is kept in the "thinlto-cache" folder
+                    of the containing build folder, so that subsequent builds can reuse the results of
+                    previous builds.
+
+                    To avoid running out of memory with full LTO, the number of parallel link jobs is limited
+                    based on the amount of memory in the machine, unless LLVM_PARALLEL_LINK_JOBS is passed via
+                    '--defines'. With ThinLTO, LLVM already limits the number of parallel link jobs on its own.
+
                     https://llvm.org/docs/LinkTimeOptimization.html
                     https://clang.llvm.org/docs/ThinLTO.html
 
-                    '''),
+                    ''',
                     type=str,
                     choices=['thin', 'full'])
 parser.add_argument('-n',
                     '--no-update',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script always updates the LLVM repo before building. This prevents
                     that, which can be helpful during something like bisecting or manually managing the
                     repo to pin it to a particular revision.
 
-                    '''),
+                    ''',
                     action='store_true')
 parser.add_argument('--no-ccache',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script adds LLVM_CCACHE_BUILD to the cmake options so that ccache is
                     used for the stage one build. This helps speed up compiles but it is only useful for
                     stage one, which is built using the host compiler, which usually does not change,
@@ -248,11 +277,20 @@ parser.add_argument('--no-ccache',
                     on the next build. This option prevents ccache from being used even at stage one, which
                     could be useful for benchmarking clean builds.
 
-                    '''),
+                    ''',
+                    action='store_true')
+parser.add_argument('--no-incremental',
+                    help='''\
+                    By default, the script reuses the bootstrap build folder from a previous run if the
+                    source revision, cmake options, compiler flags from the environment, and host compiler
+                    versions have not changed, skipping cmake and only rebuilding what is out of date. This
+                    option forces the bootstrap compiler to be configured and built from scratch.
+
+                    ''',
                     action='store_true')
 parser.add_argument('-p',
                     '--projects',
-                    help=textwrap.dedent('''\
+                    help='''\
                     Currently, the script only enables the clang, compiler-rt, lld, and polly folders in LLVM.
                     If you would like to override this, you can use this parameter and supply a list that is
                     supported by LLVM_ENABLE_PROJECTS.
@@ -261,11 +299,11 @@ parser.add_argument('-p',
 
                     Example: -p clang lld polly
 
-                    '''),
+                    ''',
                     nargs='+')
 opt_options.add_argument('--pgo',
                          metavar='PGO_BENCHMARK',
-                         help=textwrap.dedent('''\
+                         help='''\
                     Build the final compiler with Profile Guided Optimization, which can often improve compile
                     time performance by 15-20%% on average. The script will:
 
@@ -308,7 +346,7 @@ opt_options.add_argument('--pgo',
 
                     See https://llvm.org/docs/HowToBuildWithPGO.html for more information.
 
-                         '''),
+                         ''',
                          nargs='+',
                          choices=[
                              'kernel-defconfig',
@@ -319,16 +357,31 @@ opt_options.add_argument('--pgo',
                              'kernel-allyesconfig-slim',
                              'llvm',
                          ])
+parser.add_argument('--pgo-selective',
+                    help='''\
+                    By default, every function in LLVM is instrumented when '--pgo' is used. When this option
+                    is enabled, only the parts of clang and LLVM that are exercised when compiling C code
+                    (the frontend, lexer, parser, semantic analysis, code generation, the optimization and
+                    backend passes, and the support library) will be instrumented, using clang's
+                    '-fprofile-list'. This makes the instrumented compiler faster, which shortens the time
+                    spent running the benchmarks, at the cost of not optimizing the rest of the toolchain
+                    (such as ld.lld) as much.
+
+                    See https://clang.llvm.org/docs/UsersManual.html#instrumenting-only-selected-files-or-functions
+                    for more information.
+
+                    ''',
+                    action='store_true')
 parser.add_argument('--quiet-cmake',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script shows all output from cmake. When this option is enabled, the
                     invocations of cmake will only show warnings and errors.
 
-                    '''),
+                    ''',
                     action='store_true')
 parser.add_argument('-r',
                     '--ref',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script builds the main branch (tip of tree) of LLVM. If you would
                     like to build an older branch, use this parameter. This may be helpful in tracking
                     down an older bug to properly bisect. This value is just passed along to 'git checkout'
@@ -337,12 +390,12 @@ parser.add_argument('-r',
                     if '--llvm-folder' is provided, as the script does not manipulate a repository that it
                     does not own.
 
-                    '''),
+                    ''',
                     default='main',
                     type=str)
 clone_options.add_argument('-s',
                            '--shallow-clone',
-                           help=textwrap.dedent('''\
+                           help='''\
                     Only fetch the required objects and omit history when cloning the LLVM repo. This
                     option is only used for the initial clone, not subsequent fetches. This can break
                     the script's ability to automatically update the repo to newer revisions or branches
@@ -359,19 +412,19 @@ clone_options.add_argument('-s',
                     2. When no '--branch' is specified, only main is fetched. To work with other branches,
                        a branch other than main needs to be specified when the repo is first cloned.
 
-                           '''),
+                           ''',
                            action='store_true')
 parser.add_argument('--show-build-commands',
-                    help=textwrap.dedent('''\
+                    help='''\
                     By default, the script only shows the output of the comands it is running. When this option
                     is enabled, the invocations of cmake, ninja, and make will be shown to help with
                     reproducing issues outside of the script.
 
-                    '''),
+                    ''',
                     action='store_true')
 parser.add_argument('-t',
                     '--targets',
-                    help=textwrap.dedent('''\
+                    help='''\
                     LLVM is multitargeted by default. Currently, this script only enables the arm32, aarch64,
                     bpf, mips, powerpc, riscv, s390, and x86 backends because that's what the Linux kernel is
                     currently concerned with. If you would like to override this, you can use this parameter
@@ -381,10 +434,10 @@ parser.add_argument('-t',
 
                     Example: -t AArch64 ARM X86
 
-                    '''),
+                    ''',
                     nargs='+')
 clone_options.add_argument('--use-good-revision',
-                           help=textwrap.dedent('''\
+                           help='''\
                     By default, the script updates LLVM to the latest tip of tree revision, which may at times be
                     broken or not work right. With this option, it will checkout a known good revision of LLVM
                     that builds and works properly. If you use this option often, please remember to update the
@@ -392,12 +445,12 @@ clone_options.add_argument('--use-good-revision',
 
                     NOTE: This option cannot be used with '--shallow-clone'.
 
-                           '''),
+                           ''',
                            action='store_const',
                            const=GOOD_REVISION,
                            dest='ref')
 parser.add_argument('--vendor-string',
-                    help=textwrap.dedent('''\
+                    help='''\
                     Add this value to the clang and ld.lld version string (like "Apple clang version..."
                     or "Android clang version..."). Useful when reverting or applying patches on top
                     of upstream clang to differentiate a toolchain built with this script from
@@ -405,11 +458,20 @@ parser.add_argument('--vendor-string',
                     system's clang. Defaults to ClangBuiltLinux, can be set to an empty string to
                     override this and have no vendor in the version string.
 
-                    '''),
+                    ''',
                     type=str,
                     default='ClangBuiltLinux')
 args = parser.parse_args()
 
+if args.pgo_selective and not args.pgo:
+    parser.error("argument --pgo-selective: requires '--pgo'")
+
+# Import the builders after parsing arguments so that '--help' and invalid
+# arguments do not have to pay for loading them.
+from tc_build.llvm import can_use_perf, LLVMBootstrapBuilder, LLVMBuilder, LLVMInstrumentedBuilder, LLVMSlimBuilder, LLVMSlimInstrumentedBuilder, LLVMSourceManager  # noqa: E402
+from tc_build.kernel import KernelBuilder, LinuxSourceManager, LLVMKernelBuilder  # noqa: E402
+from tc_build.tools import HostTools, StageTools  # noqa: E402
+
 # Start tracking time that the script takes
 script_start = time.time()
 
@@ -422,15 +484,19 @@ if args.build_folder:
 else:
     build_folder = Path(tc_build_folder, 'build/llvm')
 
+# Make sure the tools needed to build LLVM are available before spending any
+# time downloading or updating source code.
+LLVMBuilder().check_dependencies()
+
 # Validate and prepare Linux source if doing BOLT or PGO with kernel benchmarks
 # Check for issues early, as these technologies are time consuming, so a user
 # might step away from the build once it looks like it has started
-if args.bolt or (args.pgo and [x for x in args.pgo if 'kernel' in x]):
+if args.bolt or (args.pgo and any('kernel' in x for x in args.pgo)):
     lsm = LinuxSourceManager()
     if args.linux_folder:
-        if not (linux_folder := Path(args.linux_folder).resolve()).exists():
-            raise RuntimeError(f"Provided Linux folder ('{args.linux_folder}') does not exist?")
-        if not Path(linux_folder, 'Makefile').exists():
+        if not (linux_folder := tc_build.utils.resolve_and_check(args.linux_folder, 'Makefile')):
+            if not Path(args.linux_folder).exists():
+                raise RuntimeError(f"Provided Linux folder ('{args.linux_folder}') does not exist?")
             raise RuntimeError(
                 f"Provided Linux folder ('{args.linux_folder}') does not appear to be a Linux kernel tree?"
             )
@@ -448,12 +514,12 @@ if args.bolt or (args.pgo and [x for x in args.pgo if 'kernel' in x]):
             )
     else:
         # Turns (6, 2, 0) into 6.2 and (6, 2, 1) into 6.2.1 to follow tarball names
-        ver_str = '.'.join(str(x) for x in DEFAULT_KERNEL_FOR_PGO if x)
-        lsm.location = Path(src_folder, f"linux-{ver_str}")
+        linux_name = 'linux-' + '.'.join(str(x) for x in DEFAULT_KERNEL_FOR_PGO if x)
+        lsm.location = Path(src_folder, linux_name)
         lsm.patches = list(src_folder.glob('*.patch'))
 
         lsm.tarball.base_download_url = 'https://cdn.kernel.org/pub/linux/kernel/v6.x'
-        lsm.tarball.local_location = lsm.location.with_name(f"{lsm.location.name}.tar.xz")
+        lsm.tarball.local_location = Path(src_folder, f"{linux_name}.tar.xz")
         lsm.tarball.remote_checksum_name = 'sha256sums.asc'
 
         tc_build.utils.print_header('Preparing Linux source for profiling runs')
@@ -461,7 +527,7 @@ if args.bolt or (args.pgo and [x for x in args.pgo if 'kernel' in x]):
 
 # Validate and configure LLVM source
 if args.llvm_folder:
-    if not (llvm_folder := Path(args.llvm_folder).resolve()).exists():
+    if not (llvm_folder := tc_build.utils.resolve_and_check(args.llvm_folder)):
         raise RuntimeError(f"Provided LLVM folder ('{args.llvm_folder}') does not exist?")
 else:
     llvm_folder = Path(src_folder, 'llvm-project')
@@ -493,13 +559,24 @@ else:
 # Configure projects
 if args.projects:
     final.projects = args.projects
+    final.validate_projects()
 elif args.full_toolchain:
     final.projects = ['all']
 else:
     final.projects = llvm_source.default_projects()
 
+# Warm up the page cache for the parts of the source that the build will read
+# in the background while the rest of the setup and cmake run.
+prefetch_folders = [Path(llvm_folder, 'llvm', folder) for folder in ('include', 'lib')]
+if 'all' not in final.projects:
+    prefetch_folders += [
+        Path(llvm_folder, project, folder) for project in final.projects
+        for folder in ('include', 'lib')
+    ]
+threading.Thread(target=tc_build.utils.prefetch_tree, args=prefetch_folders, daemon=True).start()
+
 # Warn the user of certain issues with BOLT and instrumentation
-if args.bolt and not final.can_use_perf():
+if args.bolt and not can_use_perf():
     warned = False
     has_4f158995b9cddae = Path(llvm_folder, 'bolt/lib/Passes/ValidateMemRefs.cpp').exists()
     if args.pgo and not args.assertions and not has_4f158995b9cddae:
@@ -517,10 +594,27 @@ if args.bolt and not final.can_use_perf():
         tc_build.utils.print_warning(
             "Consider dropping '--bolt' if there are any failures during the BOLT stage.")
         warned = True
-    if warned:
+    # Only give the user a chance to cancel if there is actually a user
+    # present; in CI, this is just dead time.
+    if warned and sys.stdin.isatty():
         tc_build.utils.print_warning('Continuing in 5 seconds, hit Ctrl-C to cancel...')
         time.sleep(5)
 
+# The BOLT profile is written to the build folder at the very end of the
+# build, so check that there is a reasonable amount of space for it now,
+# rather than running out after hours of building. These are rough estimates
+# for profiling a defconfig build, instrumentation is much more expensive.
+if args.bolt:
+    bolt_space_gb = 25 if can_use_perf() else 100
+    existing_folder = next(folder for folder in (build_folder, *build_folder.parents)
+                           if folder.exists())
+    if (free_gb := shutil.disk_usage(existing_folder).free / 1024**3) < bolt_space_gb:
+        tc_build.utils.print_warning(
+            f"Only {free_gb:.0f}GB free in {existing_folder}, BOLT may need around {bolt_space_gb}GB!"
+        )
+        tc_build.utils.print_warning(
+            "Consider using '--build-folder' to point to a location with more free space.")
+
 # Figure out unconditional cmake defines from input
 common_cmake_defines = {}
 if args.assertions:
@@ -532,6 +626,9 @@ if args.defines:
     defines = dict(define.split('=', 1) for define in args.defines)
     common_cmake_defines.update(defines)
 
+# The tools from the bootstrap compiler are used by all subsequent stages
+bootstrap_bin = Path(build_folder, 'bootstrap', 'bin')
+
 # Build bootstrap compiler if user did not request a single stage build
 if (use_bootstrap := not args.build_stage1_only):
     tc_build.utils.print_header('Building LLVM (bootstrap)')
@@ -540,7 +637,10 @@ if (use_bootstrap := not args.build_stage1_only):
     bootstrap.build_targets = ['distribution']
     bootstrap.ccache = not args.no_ccache
     bootstrap.cmake_defines.update(common_cmake_defines)
-    bootstrap.folders.build = Path(build_folder, 'bootstrap')
+    bootstrap.folders.build = bootstrap_bin.parent
+    # The bootstrap compiler is only used to build the other stages, so it is
+    # safe to reuse it from a previous run if nothing about it has changed.
+    bootstrap.incremental = not args.no_incremental
     bootstrap.folders.source = llvm_folder
     bootstrap.quiet_cmake = args.quiet_cmake
     bootstrap.show_commands = args.show_build_commands
@@ -550,7 +650,6 @@ if (use_bootstrap := not args.build_stage1_only):
     if args.pgo:
         bootstrap.projects.append('compiler-rt')
 
-    bootstrap.check_dependencies()
     bootstrap.configure()
     bootstrap.build()
 
@@ -564,8 +663,32 @@ for define in c_flag_defines:
 # The user's build type should be taken into account past the bootstrap compiler
 if args.build_type:
     common_cmake_defines['CMAKE_BUILD_TYPE'] = args.build_type
+    # Debug information is most of what the linker has to process in these
+    # build types, so keep it in separate .dwo files to make links faster and
+    # less memory hungry, unless the user has already made a choice.
+    if args.build_type in ('Debug', 'RelWithDebInfo'):
+        common_cmake_defines.setdefault('LLVM_USE_SPLIT_DWARF', 'ON')
 
 if args.pgo:
+    # Split the requested benchmarks into the LLVM benchmark and the kernel
+    # configurations to build ('kernel-defconfig-slim' -> 'defconfig-slim').
+    pgo_llvm = False
+    pgo_targets = []
+    for benchmark in args.pgo:
+        benchmark_type, _, pgo_target = benchmark.partition('-')
+        if benchmark_type == 'kernel':
+            pgo_targets.append(pgo_target)
+        elif benchmark_type == 'llvm':
+            pgo_llvm = True
+
+    # If the user specified both a full and slim build of the same type, remove
+    # the full build and warn them.
+    slim_configs = {s.partition('-')[0] for s in pgo_targets if s.endswith('-slim')}
+    for config_target in sorted(slim_configs.intersection(pgo_targets)):
+        tc_build.utils.print_warning(
+            f"Both full and slim were specified for {config_target}, ignoring full...")
+    pgo_targets = [s for s in pgo_targets if s not in slim_configs]
+
     if args.full_toolchain:
         instrumented = LLVMInstrumentedBuilder()
     else:
@@ -573,14 +696,42 @@ if args.pgo:
     instrumented.build_targets = ['all' if args.full_toolchain else 'distribution']
     instrumented.cmake_defines.update(common_cmake_defines)
     # We run the tests on the instrumented stage if the LLVM benchmark was enabled
-    instrumented.check_targets = args.check_targets if 'llvm' in args.pgo else None
+    instrumented.check_targets = args.check_targets if pgo_llvm else None
     instrumented.folders.build = Path(build_folder, 'instrumented')
     instrumented.folders.source = llvm_folder
     instrumented.projects = final.projects
     instrumented.quiet_cmake = args.quiet_cmake
     instrumented.show_commands = args.show_build_commands
     instrumented.targets = final.targets
-    instrumented.tools = StageTools(Path(bootstrap.folders.build, 'bin'))
+    instrumented.tools = StageTools(bootstrap_bin)
+    if args.pgo_selective:
+        # Only instrument the source files that are hot when compiling C code.
+        # Functions in other files will not have any profile data, so they
+        # will be optimized as they would be without PGO. The matching is done
+        # against the full path of the source file, see
+        # https://clang.llvm.org/docs/UsersManual.html#instrumenting-only-selected-files-or-functions
+        # for the format of this file.
+        profile_list_entries = [
+            'src:*/clang/lib/AST/*',
+            'src:*/clang/lib/Basic/*',
+            'src:*/clang/lib/CodeGen/*',
+            'src:*/clang/lib/Frontend/*',
+            'src:*/clang/lib/Lex/*',
+            'src:*/clang/lib/Parse/*',
+            'src:*/clang/lib/Sema/*',
+            'src:*/llvm/lib/Analysis/*',
+            'src:*/llvm/lib/CodeGen/*',
+            'src:*/llvm/lib/IR/*',
+            'src:*/llvm/lib/MC/*',
+            'src:*/llvm/lib/Support/*',
+            'src:*/llvm/lib/Target/*',
+            'src:*/llvm/lib/Transforms/*',
+        ]
+        profile_list = Path(build_folder, 'pgo-profile-list.txt')
+        profile_list.write_text('\n'.join(profile_list_entries) + '\n', encoding='utf-8')
+        for define in c_flag_defines:
+            instrumented.cmake_defines[define] = ' '.join(
+                [instrumented.cmake_defines[define], f"-fprofile-list={profile_list}"]).strip()
 
     tc_build.utils.print_header('Building LLVM (instrumented)')
     instrumented.configure()
@@ -588,7 +739,7 @@ if args.pgo:
 
     tc_build.utils.print_header('Generating PGO profiles')
     pgo_builders = []
-    if 'llvm' in args.pgo:
+    if pgo_llvm:
         llvm_builder = def_llvm_builder_cls()
         llvm_builder.cmake_defines.update(common_cmake_defines)
         llvm_builder.folders.build = Path(build_folder, 'profiling')
@@ -604,31 +755,17 @@ if args.pgo:
         # that case, use the bootstrap versions, which should not matter much
         # for profiling sake.
         if not args.full_toolchain:
-            llvm_builder.tools.clang_tblgen = Path(bootstrap.folders.build, 'bin/clang-tblgen')
-            llvm_builder.tools.llvm_tblgen = Path(bootstrap.folders.build, 'bin/llvm-tblgen')
+            llvm_builder.tools.clang_tblgen = Path(bootstrap_bin, 'clang-tblgen')
+            llvm_builder.tools.llvm_tblgen = Path(bootstrap_bin, 'llvm-tblgen')
         pgo_builders.append(llvm_builder)
 
-    # If the user specified both a full and slim build of the same type, remove
-    # the full build and warn them.
-    pgo_targets = [s.replace('kernel-', '') for s in args.pgo if 'kernel-' in s]
-    for pgo_target in pgo_targets:
-        if 'slim' not in pgo_target:
-            continue
-        config_target = pgo_target.split('-')[0]
-        if config_target in pgo_targets:
-            tc_build.utils.print_warning(
-                f"Both full and slim were specified for {config_target}, ignoring full...")
-            pgo_targets.remove(config_target)
-
     if pgo_targets:
         kernel_builder = LLVMKernelBuilder()
         kernel_builder.folders.build = Path(build_folder, 'linux')
         kernel_builder.folders.source = lsm.location
         kernel_builder.toolchain_prefix = instrumented.folders.build
-        for item in pgo_targets:
-            pgo_target = item.split('-')
-
-            config_target = pgo_target[0]
+        for pgo_target in pgo_targets:
+            config_target, _, variant = pgo_target.partition('-')
             # For BOLT or "slim" PGO, we limit the number of kernels we build for
             # each mode:
             #
@@ -645,7 +782,7 @@ if args.pgo:
             #
             # Just do a native build if the host target is in the list of targets
             # or the first target if not.
-            if len(pgo_target) == 2:  # slim
+            if variant == 'slim':
                 if instrumented.host_target_is_enabled():
                     llvm_targets = [instrumented.host_target()]
                 else:
@@ -680,32 +817,52 @@ final.show_commands = args.show_build_commands
 
 if args.lto:
     final.cmake_defines['LLVM_ENABLE_LTO'] = args.lto.capitalize()
+    if args.lto == 'thin':
+        final.thinlto_cache = Path(build_folder, 'thinlto-cache')
+    elif 'LLVM_PARALLEL_LINK_JOBS' not in final.cmake_defines:
+        # Full LTO links are memory hungry, running too many of them at once
+        # can result in the build getting OOM killed. Limit the number of
+        # parallel link jobs based on the amount of memory in the machine,
+        # unless the user has requested a particular value. LLVM already
+        # limits ThinLTO links to two at a time, as each one uses every CPU for
+        # its backend jobs.
+        mem_gb = tc_build.utils.get_total_memory_gb()
+        final.cmake_defines['LLVM_PARALLEL_LINK_JOBS'] = max(1, int(mem_gb // 32))
 if args.pgo:
     final.cmake_defines['LLVM_PROFDATA_FILE'] = Path(instrumented.folders.build, 'profdata.prof')
 
 if use_bootstrap:
-    final.tools = StageTools(Path(bootstrap.folders.build, 'bin'))
+    final.tools = StageTools(bootstrap_bin)
 else:
-    # If we skipped bootstrapping, we need to check the dependencies now
-    # and pass along certain user options
-    final.check_dependencies()
+    # If we skipped bootstrapping, we need to pass along certain user options
     final.ccache = not args.no_ccache
     final.tools = host_tools
 
     # If the user requested BOLT but did not specify it in their projects nor
-    # bootstrapped, we need to enable it to get the tools we need.
+    # bootstrapped, we need to get the tools we need from somewhere. Use the
+    # host's BOLT tools if they match the version of LLVM being built, as
+    # that saves building BOLT; otherwise, enable it in the final build.
     if args.bolt:
-        if not ('all' in final.projects or 'bolt' in final.projects):
-            final.projects.append('bolt')
-        final.tools.llvm_bolt = Path(final.folders.build, 'bin/llvm-bolt')
-        final.tools.merge_fdata = Path(final.folders.build, 'bin/merge-fdata')
-        final.tools.perf2bolt = Path(final.folders.build, 'bin/perf2bolt')
+        bolt_folder = Path(final.folders.build, 'bin')
+        if not final.project_is_enabled('bolt'):
+            final.set_llvm_major_version()
+            if (host_bolt_folder := host_tools.find_host_bolt_folder(final.llvm_major_version)):
+                bolt_folder = host_bolt_folder
+            else:
+                final.projects.append('bolt')
+        final.tools.llvm_bolt = Path(bolt_folder, 'llvm-bolt')
+        final.tools.merge_fdata = Path(bolt_folder, 'merge-fdata')
+        final.tools.perf2bolt = Path(bolt_folder, 'perf2bolt')
 
 if args.bolt:
     final.bolt = True
     final.bolt_builder = LLVMKernelBuilder()
     final.bolt_builder.folders.build = Path(build_folder, 'linux')
     final.bolt_builder.folders.source = lsm.location
+    # Sample less often than perf's default (4000Hz) when using perf, as the
+    # profile of a whole kernel build with branch records can grow to many
+    # gigabytes, all of which perf2bolt has to process, for little extra gain.
+    final.bolt_builder.bolt_sampling_frequency = 1500
     if final.host_target_is_enabled():
         llvm_targets = [final.host_target()]
     else:
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import os
 from pathlib import Path
 import platform
 from tempfile import TemporaryDirectory
@@ -68,7 +67,9 @@ class BinutilsBuilder(Builder):
             ] + [f"{var}={val}" for var, val in self.configure_vars.items()]
             self.run_cmd(configure_cmd, cwd=self.folders.build)
 
-            make_cmd = ['make', '-C', self.folders.build, '-s', f"-j{os.cpu_count()}", 'V=0']
+            make_cmd = [
+                'make', '-C', self.folders.build, '-s', f"-j{tc_build.utils.get_cpu_count()}", 'V=0'
+            ]
             self.run_cmd(make_cmd)
 
             if self.folders.install:
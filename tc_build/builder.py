@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import shlex
-import shutil
 import subprocess
 
 
@@ -28,12 +27,14 @@ class Builder:
 
         if self.folders.build.exists():
             if self.folders.build.is_dir():
-                shutil.rmtree(self.folders.build)
+                # LLVM build folders can contain hundreds of thousands of
+                # files, which 'rm' removes quicker than shutil.rmtree().
+                self.run_cmd(['rm', '-fr', '--', self.folders.build])
             else:
                 self.folders.build.unlink()
 
-    def run_cmd(self, cmd, capture_output=False, cwd=None):
+    def run_cmd(self, cmd, capture_output=False, cwd=None, env=None):
         if self.show_commands:
             # Acts sort of like 'set -x' in bash
             print(f"$ {' '.join([shlex.quote(str(elem)) for elem in cmd])}", flush=True)
-        return subprocess.run(cmd, capture_output=capture_output, check=True, cwd=cwd)
+        return subprocess.run(cmd, capture_output=capture_output, check=True, cwd=cwd, env=env)
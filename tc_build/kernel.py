@@ -23,6 +23,7 @@ class KernelBuilder(Builder):
         super().__init__()
 
         self.bolt_instrumentation = False
+        self.bolt_sampling_frequency = None
         self.bolt_sampling_output = None
         self.config_targets = []
         self.cross_compile = None
@@ -96,9 +97,11 @@ class KernelBuilder(Builder):
                 '--branch-filter', 'any,u',
                 '--event', 'cycles:u',
                 '--output', self.bolt_sampling_output,
-                '--',
             ]  # yapf: disable
-        make_cmd += ['make', '-C', self.folders.source, f"-skj{os.cpu_count()}"]
+            if self.bolt_sampling_frequency:
+                make_cmd.append(f"--freq={self.bolt_sampling_frequency}")
+            make_cmd.append('--')
+        make_cmd += ['make', '-C', self.folders.source, f"-skj{tc_build.utils.get_cpu_count()}"]
         make_cmd += [f"{key}={self.make_variables[key]}" for key in sorted(self.make_variables)]
         make_cmd += [*self.config_targets, 'all']
 
@@ -346,6 +349,7 @@ class LLVMKernelBuilder(Builder):
         super().__init__()
 
         self.bolt_instrumentation = False
+        self.bolt_sampling_frequency = None
         self.bolt_sampling_output = None
         self.matrix = {}
         self.toolchain_prefix = None
@@ -407,6 +411,7 @@ class LLVMKernelBuilder(Builder):
 
         for builder in builders:
             builder.bolt_instrumentation = self.bolt_instrumentation
+            builder.bolt_sampling_frequency = self.bolt_sampling_frequency
             builder.bolt_sampling_output = self.bolt_sampling_output
             builder.folders.build = self.folders.build
             builder.folders.source = self.folders.source
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import contextlib
+import functools
+import hashlib
 import os
 from pathlib import Path
 import platform
@@ -13,11 +15,52 @@ from tc_build.builder import Builder
 import tc_build.utils
 
 
+# The result of this check will not change during a run, so only do it once.
+@functools.lru_cache(maxsize=None)
+def can_use_perf():
+    # Make sure perf is in the environment
+    if shutil.which('perf'):
+        try:
+            perf_cmd = [
+                'perf', 'record',
+                '--branch-filter', 'any,u',
+                '--event', 'cycles:u',
+                '--output', '/dev/null',
+                # Whether the events can be opened is determined before the
+                # command is started, so there is no need to run for long.
+                '--', 'true',
+            ]  # yapf: disable
+            subprocess.run(perf_cmd,
+                           check=True,
+                           stderr=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            pass  # Fallthrough to False below
+        else:
+            return True
+
+    return False
+
+
+# The list of targets is needed several times during a build (validating the
+# targets of each stage, figuring out default targets) but the source is not
+# updated after it is first requested, so only parse it once per folder.
+@functools.lru_cache(maxsize=None)
 def get_all_targets(llvm_folder):
     contents = Path(llvm_folder, 'llvm/CMakeLists.txt').read_text(encoding='utf-8')
     if not (match := re.search(r'set\(LLVM_ALL_TARGETS([\w|\s]+)\)', contents)):
         raise RuntimeError('Could not find LLVM_ALL_TARGETS?')
-    return [val for target in match.group(1).splitlines() if (val := target.strip())]
+    return tuple(val for target in match.group(1).splitlines() if (val := target.strip()))
+
+
+# The host clang's default target triple will not change during a run and it
+# is needed by every stage, so only ask for it once.
+@functools.lru_cache(maxsize=None)
+def get_clang_default_target_triple():
+    return subprocess.run(['clang', '-print-target-triple'],
+                          capture_output=True,
+                          check=True,
+                          text=True).stdout.strip()
 
 
 class LLVMBuilder(Builder):
@@ -31,19 +74,21 @@ class LLVMBuilder(Builder):
         self.ccache = False
         self.check_targets = []
         self.cmake_defines = {}
+        self.incremental = False
         self.install_targets = []
         self.llvm_major_version = 0
         self.tools = None
         self.projects = []
         self.quiet_cmake = False
         self.targets = []
+        self.thinlto_cache = None
 
     def bolt_clang(self):
         # Default to instrumentation, as it should be universally available.
         mode = 'instrumentation'
         # If we can use perf for branch sampling, we switch to that mode, as
         # it is much quicker and it can result in more performance gains
-        if self.can_use_perf():
+        if can_use_perf():
             mode = 'sampling'
 
         tc_build.utils.print_header(f"Performing BOLT with {mode}")
@@ -82,7 +127,7 @@ class LLVMBuilder(Builder):
         # With instrumentation, we need to combine the profiles we generated,
         # as they are separated by PID
         if mode == 'instrumentation':
-            fdata_files = bolt_profile.parent.glob(f"{bolt_profile.name}.*.fdata")
+            fdata_files = list(bolt_profile.parent.glob(f"{bolt_profile.name}.*.fdata"))
 
             # merge-fdata will print one line for each .fdata it merges.
             # Redirect the output to a log file in case it ever needs to be
@@ -92,13 +137,17 @@ class LLVMBuilder(Builder):
             with bolt_profile.open('w', encoding='utf-8') as out_file, \
                  merge_fdata_log.open('w', encoding='utf-8') as err_file:
                 tc_build.utils.print_info('Merging .fdata files, this might take a while...')
-                subprocess.run([self.tools.merge_fdata, *list(fdata_files)],
+                subprocess.run([self.tools.merge_fdata, *fdata_files],
                                check=True,
                                stderr=err_file,
                                stdout=out_file)
             for fdata_file in fdata_files:
                 fdata_file.unlink()
 
+        # perf2bolt processes the whole perf.data file in a single pass but it
+        # writes the intermediate 'perf script' output to TMPDIR, which can be
+        # several gigabytes for a kernel build and exhaust a tmpfs /tmp. Keep
+        # it in the build folder, which already has to hold perf.data.
         if mode == 'sampling':
             perf2bolt_cmd = [
                 self.tools.perf2bolt,
@@ -108,7 +157,8 @@ class LLVMBuilder(Builder):
                 bolt_profile,
                 clang,
             ]
-            self.run_cmd(perf2bolt_cmd)
+            perf2bolt_env = {**os.environ, 'TMPDIR': str(self.folders.build)}
+            self.run_cmd(perf2bolt_cmd, env=perf2bolt_env)
             self.bolt_builder.bolt_sampling_output.unlink()
 
         # Now actually optimize clang
@@ -163,24 +213,11 @@ class LLVMBuilder(Builder):
             self.run_cmd([*base_ninja_cmd, *install_targets], capture_output=True)
             tc_build.utils.create_gitignore(self.folders.install)
 
-    def can_use_perf(self):
-        # Make sure perf is in the environment
-        if shutil.which('perf'):
-            try:
-                perf_cmd = [
-                    'perf', 'record',
-                    '--branch-filter', 'any,u',
-                    '--event', 'cycles:u',
-                    '--output', '/dev/null',
-                    '--', 'sleep', '1',
-                ]  # yapf: disable
-                subprocess.run(perf_cmd, capture_output=True, check=True)
-            except subprocess.CalledProcessError:
-                pass  # Fallthrough to False below
-            else:
-                return True
-
-        return False
+    def can_use_thinlto_cache(self):
+        if self.cmake_defines.get('LLVM_ENABLE_LTO', '').lower() != 'thin':
+            return False
+        # The cache flags are specific to ld.lld
+        return bool(self.tools.ld) and 'lld' in Path(self.tools.ld).name
 
     def check_dependencies(self):
         deps = ['cmake', 'curl', 'git', 'ninja']
@@ -245,7 +282,23 @@ class LLVMBuilder(Builder):
         self.cmake_defines['CMAKE_C_COMPILER'] = self.tools.cc
         self.cmake_defines['CMAKE_CXX_COMPILER'] = self.tools.cxx
         if self.bolt:
-            self.cmake_defines['CMAKE_EXE_LINKER_FLAGS'] = '-Wl,--emit-relocs'
+            # BOLT needs relocations to rewrite the binary, do not clobber any
+            # linker flags the user may have passed.
+            ldflags = self.cmake_defines.get('CMAKE_EXE_LINKER_FLAGS', '').split()
+            self.cmake_defines['CMAKE_EXE_LINKER_FLAGS'] = ' '.join([*ldflags, '-Wl,--emit-relocs'])
+        # LLVM only enables a ThinLTO cache when LLVM_USE_LINKER is exactly
+        # 'lld' and it places it in the build folder, which is removed on each
+        # configure. Use a cache outside of the build folder so that links can
+        # reuse backend compiles from previous invocations.
+        if self.thinlto_cache and self.can_use_thinlto_cache():
+            self.thinlto_cache.mkdir(exist_ok=True, parents=True)
+            thinlto_cache_flags = [
+                f"-Wl,--thinlto-cache-dir={self.thinlto_cache}",
+                '-Wl,--thinlto-cache-policy=cache_size_bytes=20g:cache_size_files=100000',
+            ]
+            for define in ['CMAKE_EXE_LINKER_FLAGS', 'CMAKE_SHARED_LINKER_FLAGS']:
+                ldflags = self.cmake_defines.get(define, '').split()
+                self.cmake_defines[define] = ' '.join([*ldflags, *thinlto_cache_flags])
         if self.folders.install:
             self.cmake_defines['CMAKE_INSTALL_PREFIX'] = self.folders.install
 
@@ -283,7 +336,7 @@ class LLVMBuilder(Builder):
         # Clear Linux needs a different target to find all of the C++ header files, otherwise
         # stage 2+ compiles will fail without this
         # We figure this out based on the existence of x86_64-generic-linux in the C++ headers path
-        if list(Path('/usr/include/c++').glob('*/x86_64-generic-linux')):
+        if any(Path('/usr/include/c++').glob('*/x86_64-generic-linux')):
             self.cmake_defines['LLVM_HOST_TRIPLE'] = 'x86_64-generic-linux'
 
         # By default, the Linux triples are for glibc, which might not work on
@@ -294,16 +347,55 @@ class LLVMBuilder(Builder):
         # toolchain, as this may not be portable. Since distribution is not a
         # primary goal of tc-build, this is not abstracted further.
         if shutil.which('clang') and not os.environ.get('DISTRIBUTING'):
-            default_target_triple = subprocess.run(['clang', '-print-target-triple'],
-                                                   capture_output=True,
-                                                   check=True,
-                                                   text=True).stdout.strip()
-            self.cmake_defines['LLVM_DEFAULT_TARGET_TRIPLE'] = default_target_triple
+            self.cmake_defines['LLVM_DEFAULT_TARGET_TRIPLE'] = get_clang_default_target_triple()
 
         cmake_cmd += [f'-D{key}={self.cmake_defines[key]}' for key in sorted(self.cmake_defines)]
 
+        # If the build folder was configured with the exact same cmake
+        # invocation, environment flags, and host compiler against the same
+        # source revision, there is no need to start from scratch; ninja will
+        # rerun cmake if any of the cmake files change and rebuild anything
+        # that is out of date.
+        fingerprint_file = Path(self.folders.build, '.tc-build-fingerprint')
+        if self.incremental:
+            fingerprint = self.get_configure_fingerprint(cmake_cmd)
+            if Path(self.folders.build, 'build.ninja').exists() and fingerprint_file.exists() and \
+               fingerprint_file.read_text(encoding='utf-8') == fingerprint:
+                tc_build.utils.print_info(
+                    f"{self.folders.build} is already configured with the same options, skipping cmake..."
+                )
+                return
+
         self.clean_build_folder()
         self.run_cmd(cmake_cmd)
+        if self.incremental:
+            fingerprint_file.write_text(fingerprint, encoding='utf-8')
+
+    def get_configure_fingerprint(self, cmake_cmd):
+        try:
+            revision = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                      capture_output=True,
+                                      check=True,
+                                      cwd=self.folders.source,
+                                      text=True).stdout.strip()
+        except subprocess.CalledProcessError:
+            # Not a git repository, cmake regenerating itself will have to do
+            revision = ''
+
+        # cmake picks up flags from the environment and the host compiler may
+        # have been upgraded in place, neither of which show up in cmake_cmd.
+        env_flags = [
+            f"{var}={os.environ.get(var, '')}" for var in ('CFLAGS', 'CXXFLAGS', 'LDFLAGS')
+        ]
+        compiler_versions = [
+            subprocess.run([compiler, '--version'], capture_output=True, check=True,
+                           text=True).stdout for compiler in (self.tools.cc, self.tools.cxx)
+        ]
+
+        fingerprint = hashlib.sha256(revision.encode('utf-8'))
+        for elem in [*cmake_cmd, *env_flags, *compiler_versions]:
+            fingerprint.update(b'\0' + str(elem).encode('utf-8'))
+        return fingerprint.hexdigest()
 
     def host_target(self):
         uname_to_llvm = {
@@ -369,6 +461,19 @@ class LLVMBuilder(Builder):
                 print()
         tc_build.utils.flush_std_err_out()
 
+    def validate_projects(self):
+        if not self.folders.source:
+            raise RuntimeError('No source folder set?')
+
+        for project in self.projects:
+            if project == 'all':
+                continue
+
+            if not Path(self.folders.source, project).is_dir():
+                raise RuntimeError(
+                    f"Requested project ('{project}') was not found in {self.folders.source}, check spelling?"
+                )
+
     def validate_targets(self):
         if not self.folders.source:
             raise RuntimeError('No source folder set?')
@@ -382,10 +487,8 @@ class LLVMBuilder(Builder):
                 continue
 
             if target not in all_targets:
-                # tuple() for shorter pretty printing versus instead of
-                # ('{"', '".join(all_targets)}')
                 raise RuntimeError(
-                    f"Requested target ('{target}') was not found in LLVM_ALL_TARGETS {tuple(all_targets)}, check spelling?"
+                    f"Requested target ('{target}') was not found in LLVM_ALL_TARGETS {all_targets}, check spelling?"
                 )
 
 
@@ -580,16 +683,45 @@ class LLVMSourceManager:
 
         tc_build.utils.print_header('Downloading LLVM')
 
+        url = 'https://github.com/llvm/llvm-project'
+
+        # llvm-project has a large and constantly growing number of branches
+        # for stacked pull requests and reverts, which are never useful for
+        # building. Skip them with negative refspecs if git supports them.
+        # 'git clone' only applies a configured refspec to fetches after the
+        # clone itself, so set up the repository by hand to apply them to the
+        # initial fetch as well. A shallow clone of main only fetches main, so
+        # there is nothing to skip in that case.
+        if self.supports_negative_refspecs() and not (shallow and ref == 'main'):
+            subprocess.run(['git', 'init', '--quiet', self.repo], check=True)
+            try:
+                self.git(['remote', 'add', 'origin', url])
+                for branch in ('users/*', 'revert-*'):
+                    self.git(['config', '--add', 'remote.origin.fetch', f"^refs/heads/{branch}"])
+                git_fetch = ['fetch', 'origin']
+                if shallow:
+                    git_fetch.append('--depth=1')
+                self.git(git_fetch)
+            except BaseException:
+                # Like 'git clone', do not leave a partial repository behind,
+                # as it would be mistaken for a complete one on the next run.
+                shutil.rmtree(self.repo)
+                raise
+            self.git(['checkout', ref])
+            return
+
         git_clone = ['git', 'clone']
         if shallow:
             git_clone.append('--depth=1')
             if ref != 'main':
                 git_clone.append('--no-single-branch')
-        git_clone += ['https://github.com/llvm/llvm-project', self.repo]
+        git_clone += [url, self.repo]
 
         subprocess.run(git_clone, check=True)
 
-        self.git(['checkout', ref])
+        # The clone is already on main, llvm-project's default branch
+        if ref != 'main':
+            self.git(['checkout', ref])
 
     def git(self, cmd, capture_output=False):
         return subprocess.run(['git', *cmd],
@@ -602,16 +734,29 @@ class LLVMSourceManager:
         return self.git(cmd, capture_output=True).stdout.strip()
 
     def is_shallow(self):
-        git_dir = self.git_capture(['rev-parse', '--git-dir'])
-        return Path(git_dir, 'shallow').exists()
+        # Avoid asking git in the common case of a regular clone. '.git' is a
+        # file when the repo is a worktree, in which case git knows best.
+        if (git_dir := Path(self.repo, '.git')).is_dir():
+            return Path(git_dir, 'shallow').exists()
+        return self.git_capture(['rev-parse', '--is-shallow-repository']) == 'true'
 
     def ref_exists(self, ref):
         try:
-            self.git(['show-branch', ref])
+            self.git(['rev-parse', '--verify', '--quiet', f"{ref}^{{commit}}"], capture_output=True)
         except subprocess.CalledProcessError:
             return False
         return True
 
+    def supports_negative_refspecs(self):
+        # Negative refspecs were introduced in git 2.29
+        git_version = subprocess.run(['git', '--version'],
+                                     capture_output=True,
+                                     check=True,
+                                     text=True).stdout
+        if not (match := re.search(r'(\d+)\.(\d+)', git_version)):
+            return False
+        return (int(match.group(1)), int(match.group(2))) >= (2, 29)
+
     def update(self, ref):
         tc_build.utils.print_header('Updating LLVM')
 
@@ -625,5 +770,8 @@ class LLVMSourceManager:
         local_ref = None
         with contextlib.suppress(subprocess.CalledProcessError):
             local_ref = self.git_capture(['symbolic-ref', '-q', 'HEAD'])
+        # The remote branches were already fetched above, so rebase on top of
+        # them directly rather than using 'git pull', which would contact the
+        # remote a second time.
         if local_ref and local_ref.startswith('refs/heads/'):
-            self.git(['pull', '--rebase', 'origin', local_ref.replace('refs/heads/', '')])
+            self.git(['rebase', f"origin/{local_ref.replace('refs/heads/', '')}"])
@@ -6,7 +6,7 @@ import subprocess
 
 import tc_build.utils
 
-# When doing verification, read 128MiB at a time
+# When downloading and verifying, read 128KiB at a time
 BYTES_TO_READ = 131072
 
 
@@ -30,12 +30,12 @@ class Tarball:
             self.remote_tarball_name = self.local_location.name
 
         full_url = f"{self.base_download_url}/{self.remote_tarball_name}"
-        tc_build.utils.print_info(f"Downloading {full_url} to {self.local_location}...")
-        tc_build.utils.curl(full_url, destination=self.local_location)
 
-        # If there is a remote checksum file, download it, find the checksum
-        # for the particular tarball, compute the downloaded file's checksum,
-        # and finally compare the two.
+        # If there is a remote checksum file, download it and find the
+        # checksum for the particular tarball before downloading the tarball,
+        # so that the tarball can be hashed as it is written to disk, rather
+        # than reading it back in afterwards.
+        file_hash = None
         if self.remote_checksum_name:
             checksums = tc_build.utils.curl(f"{self.base_download_url}/{self.remote_checksum_name}")
             if not (match := re.search(
@@ -49,16 +49,37 @@ class Tarball:
             else:
                 raise RuntimeError(
                     f"No supported hashlib for {self.remote_checksum_name}, add support for it?")
-            with self.local_location.open('rb') as file:
-                while (data := file.read(BYTES_TO_READ)):
-                    file_hash.update(data)
 
-            computed_checksum = file_hash.hexdigest()
-            expected_checksum = match.groups()[0]
-            if computed_checksum != expected_checksum:
-                raise RuntimeError(
-                    f"Computed checksum of {self.local_destination} ('{computed_checksum}') differs from expected checksum ('{expected_checksum}'), remove it and try again?"
-                )
+        tc_build.utils.print_info(f"Downloading {full_url} to {self.local_location}...")
+        # Download to a temporary name and only move it into place once it has
+        # been verified, so that an interrupted or failed download is never
+        # mistaken for a complete tarball on the next run.
+        partial_location = self.local_location.with_name(f"{self.local_location.name}.part")
+        try:
+            if file_hash:
+                self._download_and_verify(full_url, partial_location, file_hash, match.groups()[0])
+            else:
+                tc_build.utils.curl(full_url, destination=partial_location)
+        except BaseException:
+            partial_location.unlink(missing_ok=True)
+            raise
+        partial_location.replace(self.local_location)
+
+    def _download_and_verify(self, full_url, destination, file_hash, expected_checksum):
+        curl_cmd = ['curl', '-fLSs', full_url]
+        with subprocess.Popen(curl_cmd, stdout=subprocess.PIPE) as curl_proc, \
+             destination.open('wb') as file:
+            while (data := curl_proc.stdout.read(BYTES_TO_READ)):
+                file_hash.update(data)
+                file.write(data)
+        if curl_proc.returncode:
+            raise subprocess.CalledProcessError(curl_proc.returncode, curl_cmd)
+
+        computed_checksum = file_hash.hexdigest()
+        if computed_checksum != expected_checksum:
+            raise RuntimeError(
+                f"Computed checksum of {self.local_location} ('{computed_checksum}') differs from expected checksum ('{expected_checksum}'), try again?"
+            )
 
     def extract(self, extraction_location):
         if not self.local_location:
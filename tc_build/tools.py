@@ -38,6 +38,32 @@ class HostTools:
 
         return None
 
+    def find_host_bolt_folder(self, llvm_major_version):
+        # Prefer the BOLT tools next to CC, otherwise look for them in PATH
+        if self.cc_is_clang and Path(self.cc.parent, 'llvm-bolt').exists():
+            bolt_folder = self.cc.parent
+        elif (llvm_bolt := shutil.which('llvm-bolt')):
+            bolt_folder = Path(llvm_bolt).resolve().parent  # resolve() for Debian/Ubuntu variants
+        else:
+            return None
+
+        bolt_tools = ['llvm-bolt', 'merge-fdata', 'perf2bolt']
+        if not all(Path(bolt_folder, tool).exists() for tool in bolt_tools):
+            return None
+
+        # The options passed to llvm-bolt are selected based on the LLVM
+        # source being built, so only use tools from the same major version.
+        bolt_version = subprocess.run([Path(bolt_folder, 'llvm-bolt'), '--version'],
+                                      capture_output=True,
+                                      check=False,
+                                      text=True).stdout
+        if not (match := re.search(r'LLVM version (\d+)', bolt_version)):
+            return None
+        if int(match.group(1)) != llvm_major_version:
+            return None
+
+        return bolt_folder
+
     def find_host_cc(self):
         # resolve() is called here and below to get /usr/lib/llvm-#/bin/... for
         # versioned LLVM binaries on Debian and Ubuntu.
@@ -115,18 +141,21 @@ class HostTools:
         return Path(tool)
 
     def generate_versioned_binaries(self):
-        try:
-            cmakelists_txt = tc_build.utils.curl(
-                'https://raw.githubusercontent.com/llvm/llvm-project/main/cmake/Modules/LLVMVersion.cmake'
-            )
-        except subprocess.CalledProcessError:
-            llvm_tot_ver = 19
-        else:
-            if not (match := re.search(r'set\(LLVM_VERSION_MAJOR\s+(\d+)', cmakelists_txt)):
-                raise RuntimeError('Could not find LLVM_VERSION_MAJOR in CMakeLists.txt?')
-            llvm_tot_ver = int(match.groups()[0])
-
-        return [f'clang-{num}' for num in range(llvm_tot_ver, 6, -1)]
+        # Look for versioned clang binaries (such as the ones from apt.llvm.org)
+        # in PATH directly, rather than fetching the latest LLVM version from
+        # GitHub and checking for every version up to it, which requires a
+        # network round trip on every run.
+        clang_versions = set()
+        for folder in os.environ.get('PATH', '').split(os.pathsep):
+            try:
+                entries = [entry.name for entry in Path(folder or '.').iterdir()]
+            except OSError:
+                continue
+            for entry in entries:
+                if (match := re.fullmatch(r'clang-(\d+)', entry)) and int(match.group(1)) > 6:
+                    clang_versions.add(int(match.group(1)))
+
+        return [f'clang-{num}' for num in sorted(clang_versions, reverse=True)]
 
     def show_compiler_linker(self):
         print(f"CC: {self.cc}")
@@ -146,9 +175,10 @@ class HostTools:
         cc_cmd = [self.cc, f'-fuse-ld={ld}', '-o', '/dev/null', '-x', 'c', '-']
         try:
             subprocess.run(cc_cmd,
-                           capture_output=True,
                            check=True,
                            input='int main(void) { return 0; }',
+                           stderr=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL,
                            text=True)
         except subprocess.CalledProcessError:
             if warn:
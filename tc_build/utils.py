@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+from pathlib import Path
 import subprocess
 import sys
 import time
@@ -22,6 +24,14 @@ def flush_std_err_out():
     sys.stdout.flush()
 
 
+def get_cpu_count():
+    # Respect any CPU affinity restrictions (such as taskset or a container's
+    # cpuset), which os.cpu_count() does not account for.
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
 def get_duration(start_seconds, end_seconds=None):
     if not end_seconds:
         end_seconds = time.time()
@@ -42,6 +52,10 @@ def get_duration(start_seconds, end_seconds=None):
     return ' '.join(parts)
 
 
+def get_total_memory_gb():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024**3)
+
+
 def libc_is_musl():
     # musl's ldd does not appear to support '--version' directly, as its return
     # code is 1 and it prints all text to stderr. However, it does print the
@@ -51,6 +65,40 @@ def libc_is_musl():
     return 'musl' in (ldd_out.stderr if ldd_out.stderr else ldd_out.stdout)
 
 
+def prefetch_tree(*folders):
+    # Ask the kernel to start reading the files in the given folders into the
+    # page cache, so that later reads (such as the ones done by cmake and the
+    # compiler) are less likely to block on disk I/O. This is only a hint, so
+    # any errors are ignored.
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for file in files:
+                try:
+                    fd = os.open(Path(root, file), os.O_RDONLY)
+                except OSError:
+                    continue
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+                finally:
+                    os.close(fd)
+
+
+def resolve_and_check(path, must_have=None):
+    # Resolve path and make sure that it exists or, if must_have is provided,
+    # that must_have exists within it, which implies the former. Returns the
+    # resolved path on success and None otherwise.
+    resolved = Path(os.path.realpath(path))
+    try:
+        (Path(resolved, must_have) if must_have else resolved).stat()
+    except OSError:
+        return None
+    return resolved
+
+
 def print_color(color, string):
     print(f"{color}{string}\033[0m", flush=True)
 